@@ -1,40 +1,76 @@
-import os
 import sys
-import json
+import orjson
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-load_dotenv()
+from settings import get_settings
 
-API_KEY = os.getenv("SHOTSTACK_API_KEY")
-BASE_URL = "https://api.shotstack.io/stage/render"  # same environment as main.py
+settings = get_settings()
+
+API_KEY = settings.shotstack_api_key
+BASE_URL = f"https://api.shotstack.io/{settings.shotstack_env}/render"  # same environment as main.py
 
 if not API_KEY:
     raise RuntimeError("SHOTSTACK_API_KEY is not set in .env")
 
-if len(sys.argv) < 2:
-    print("Usage: python check_render.py <render_id>")
-    sys.exit(1)
+# (connect, read) timeouts for Shotstack requests
+TIMEOUT = (5, 25)
+
+# Retry transient failures (rate limits, 5xx) with exponential backoff,
+# honouring Retry-After. raise_on_status=False hands back the last
+# response so its status is still printed when retries run out.
+RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# One pooled session: repeated status checks reuse the TLS connection
+# instead of paying a fresh handshake per request.
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=RETRY),
+)
+SESSION.headers.update(
+    {
+        "Accept": "application/json",
+        "x-api-key": API_KEY,
+    }
+)
+
+
+def get_render_status(render_id: str) -> requests.Response:
+    """Fetch the raw Shotstack status response for a render."""
+    return SESSION.get(f"{BASE_URL}/{render_id}", timeout=TIMEOUT)
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print("Usage: python check_render.py <render_id>")
+        sys.exit(1)
+
+    render_id = sys.argv[1]
 
-render_id = sys.argv[1]
-url = f"{BASE_URL}/{render_id}"
+    print(f"🔍 Checking render status for: {render_id}")
+    print(f"URL: {BASE_URL}/{render_id}\n")
 
-headers = {
-    "Accept": "application/json",
-    "x-api-key": API_KEY,
-}
+    resp = get_render_status(render_id)
 
-print(f"🔍 Checking render status for: {render_id}")
-print(f"URL: {url}\n")
+    print(f"📡 STATUS CODE: {resp.status_code}\n")
 
-resp = requests.get(url, headers=headers, timeout=30)
+    try:
+        data = orjson.loads(resp.content)
+    except orjson.JSONDecodeError:
+        data = {"raw": resp.text}
 
-print(f"📡 STATUS CODE: {resp.status_code}\n")
+    print("🔎 RESPONSE:")
+    print(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()[:2000])
 
-try:
-    data = resp.json()
-except Exception:
-    data = {"raw": resp.text}
 
-print("🔎 RESPONSE:")
-print(json.dumps(data, indent=2)[:2000])
+if __name__ == "__main__":
+    main()
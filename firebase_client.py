@@ -1,125 +1,430 @@
-import json
+import functools
 import logging
-import os
-from typing import Any, Dict, List, Tuple
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
+import orjson
 from google.cloud import firestore
+from google.cloud.firestore_v1.watch import Watch
+from google.oauth2 import service_account
+
+from settings import get_settings
+
+settings = get_settings()
 
 # ---------------------------------------------------------------------------
 # Logging
 # ---------------------------------------------------------------------------
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=settings.log_level)
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # Service account key handling
 # ---------------------------------------------------------------------------
 
-# Where we want the key JSON file inside the container
-FIREBASE_KEY_PATH = "/app/firebase-key.json"
-
 # This env var will contain the full JSON of your service account
-SERVICE_ACCOUNT_JSON = os.getenv("FIREBASE_KEY_JSON")
+SERVICE_ACCOUNT_JSON = settings.firebase_key_json
+
+
+@functools.lru_cache(maxsize=1)
+def _load_creds() -> Tuple[Optional[service_account.Credentials], Optional[str]]:
+    """
+    Parse FIREBASE_KEY_JSON once per process into (credentials, project_id).
+
+    Credentials are built in memory (no key file written to disk);
+    (None, None) means Firestore falls back to default Google auth.
+    """
+    if not SERVICE_ACCOUNT_JSON:
+        logger.warning(
+            "⚠️ FIREBASE_KEY_JSON env var is not set; "
+            "Firestore will rely on default Google auth."
+        )
+        return None, None
 
-if SERVICE_ACCOUNT_JSON:
     try:
-        # Write the JSON to /app/firebase-key.json on startup
-        with open(FIREBASE_KEY_PATH, "w") as f:
-            f.write(SERVICE_ACCOUNT_JSON)
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = FIREBASE_KEY_PATH
-        logger.info("✅ Wrote FIREBASE_KEY_JSON to %s", FIREBASE_KEY_PATH)
+        creds = service_account.Credentials.from_service_account_info(
+            orjson.loads(SERVICE_ACCOUNT_JSON)
+        )
     except Exception as e:
-        logger.exception("❌ Failed to write FIREBASE_KEY_JSON: %s", e)
-else:
-    logger.warning(
-        "⚠️ FIREBASE_KEY_JSON env var is not set; "
-        "Firestore will rely on default Google auth."
-    )
+        logger.exception("❌ Failed to load FIREBASE_KEY_JSON: %s", e)
+        return None, None
+
+    logger.info("✅ Loaded service account credentials from FIREBASE_KEY_JSON")
+    return creds, creds.project_id
+
+
+credentials, PROJECT_ID = _load_creds()
 
 # ---------------------------------------------------------------------------
 # Firestore setup
 # ---------------------------------------------------------------------------
 
 # Root collection for jobs (can be overridden from env)
-JOBS_COLLECTION = os.getenv("FIREBASE_JOBS_COLLECTION", "jobs")
+JOBS_COLLECTION = settings.jobs_collection
+
+# Per-job subcollection holding the job's event log
+EVENTS_SUBCOLLECTION = "events"
 
-# Firestore client (uses GOOGLE_APPLICATION_CREDENTIALS we just set)
-db = firestore.Client()
+# Server-side timestamp sentinel, bound once instead of looked up per write
+SERVER_TS = firestore.SERVER_TIMESTAMP
 
-# Keep this name for compatibility with main.py
-jobs_collection = db.collection(JOBS_COLLECTION)
+# Bumps a job's events_count alongside every event write, without a read
+EVENTS_COUNT_INCREMENT = firestore.Increment(1)
+
+# Recorded on each job this worker claims
+WORKER_ID = settings.worker_id
+
+# Firestore API endpoint (override with a regional endpoint if closer)
+FIRESTORE_API_ENDPOINT = settings.firestore_api_endpoint
+
+# Single long-lived Firestore client for the whole process. Its gRPC channel
+# is created once and kept alive between polls (the SDK sets a 30s keepalive).
+db = firestore.Client(
+    project=PROJECT_ID,
+    credentials=credentials,
+    client_options={"api_endpoint": FIRESTORE_API_ENDPOINT},
+)
+
+# Resolved once at import; every helper reuses this reference
+JOBS = db.collection(JOBS_COLLECTION)
 logger.info("Firestore jobs collection set to: %s", JOBS_COLLECTION)
 
+
+def _events_ref(job_ref: firestore.DocumentReference) -> firestore.CollectionReference:
+    """Events subcollection for a job."""
+    return job_ref.collection(EVENTS_SUBCOLLECTION)
+
+
 # ---------------------------------------------------------------------------
 # Fetch pending jobs
 # ---------------------------------------------------------------------------
 
+# Firestore caps a single WriteBatch / transaction commit at 500 writes
+MAX_BATCH_OPS = 500
+
+# Fields the worker actually reads from each job type. Queries project to
+# these so large payload/metadata fields never cross the wire.
+# (metadata.retry_count is needed to bump it when a submit fails.)
+PENDING_JOB_FIELDS = ["template", "video_url", "metadata.retry_count"]
+RENDERING_JOB_FIELDS = ["metadata.render_id"]
+
+
 def get_pending_jobs(limit: int = 5) -> List[Tuple[str, Dict[str, Any]]]:
     """
-    Fetch pending, unclaimed jobs from Firestore.
+    Fetch pending jobs from Firestore.
 
-    We stream all docs from the jobs collection and filter in Python for:
-      - status == "pending"
-      - claimed is missing or False
+    Filtering happens server-side on status == "pending" (claiming moves a
+    job to "processing", so no separate claimed flag is needed) and
+    available_at <= now (jobs backing off after a failed submit stay out of
+    the way), backed by the (status, available_at) composite index in
+    firestore.indexes.json, so each poll reads at most `limit` documents no
+    matter how big the collection gets. Results are ordered by available_at.
     """
-    logger.info("🔍 Scanning Firestore collection '%s' for pending jobs...", JOBS_COLLECTION)
+    logger.debug(
+        "🔍 Querying Firestore collection '%s' for up to %d pending job(s)...",
+        JOBS_COLLECTION,
+        limit,
+    )
+
+    docs = list(_pending_query(limit).stream())
 
-    docs = list(jobs_collection.stream())
-    logger.info("🔍 Found %d document(s) total in '%s'", len(docs), JOBS_COLLECTION)
+    pending = _to_jobs(docs)
+
+    logger.info("✅ Returning %d pending job(s)", len(pending))
+    return pending
+
+
+def _to_jobs(docs: Iterable[firestore.DocumentSnapshot]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Convert snapshots to (id, data) pairs, tracing each doc at DEBUG only."""
+    jobs = [(doc.id, doc.to_dict() or {}) for doc in docs]
+    if logger.isEnabledFor(logging.DEBUG):
+        for job_id, data in jobs:
+            logger.debug("   • Doc %s => %r", job_id, data)
+    return jobs
+
+
+def _get_field(doc: firestore.DocumentSnapshot, field_path: str) -> Any:
+    """Read one (dotted) field straight off a snapshot, None if missing."""
+    try:
+        return doc.get(field_path)
+    except KeyError:
+        return None
 
-    pending: List[Tuple[str, Dict[str, Any]]] = []
 
+def _pending_query(limit: int) -> firestore.Query:
+    """Build the query for the head of the pending queue: jobs available now."""
+    return (
+        JOBS.select(PENDING_JOB_FIELDS)
+        .where("status", "==", "pending")
+        .where("available_at", "<=", datetime.now(timezone.utc))
+        .order_by("available_at")
+        .limit(limit)
+    )
+
+
+# Constant field updates shared by every call (the SDK only reads them)
+_CLAIM_PROCESSING_UPDATE = {
+    "claimed_at": SERVER_TS,
+    "worker_id": WORKER_ID,
+    "updated_at": SERVER_TS,
+    "status": "processing",
+    "events_count": EVENTS_COUNT_INCREMENT,
+}
+_CLAIM_PROCESSING_EVENT = {
+    "type": "processing",
+    "message": "Worker picked up job",
+    "created_at": SERVER_TS,
+}
+_COMPLETED_UPDATE_TEMPLATE = {
+    "status": "completed",
+    "finished_at": SERVER_TS,
+    "metadata": {"status": "completed"},
+}
+
+
+@firestore.transactional
+def _claim_in_transaction(
+    transaction: firestore.Transaction, query: firestore.Query
+) -> List[firestore.DocumentSnapshot]:
+    docs = list(transaction.get(query))
     for doc in docs:
-        data = doc.to_dict() or {}
+        _stage_claim(transaction, doc.reference)
+    return docs
 
-        try:
-            data_json = json.dumps(data, default=str)
-        except TypeError:
-            data_json = str(data)
 
-        logger.info("   • Doc %s => %s", doc.id, data_json[:600])
+def _stage_claim(
+    transaction: firestore.Transaction, job_ref: firestore.DocumentReference
+) -> None:
+    """Stage the claim update and its 'processing' event (2 writes)."""
+    transaction.update(job_ref, _CLAIM_PROCESSING_UPDATE)
+    transaction.set(_events_ref(job_ref).document(), _CLAIM_PROCESSING_EVENT)
 
-        status = data.get("status")
-        claimed = data.get("claimed", False)
 
-        if status == "pending" and not claimed:
-            logger.info("   ✅ Doc %s qualifies as pending + unclaimed", doc.id)
-            pending.append((doc.id, data))
-        else:
-            logger.info(
-                "   ↩︎ Doc %s skipped (status=%r, claimed=%r)",
-                doc.id,
-                status,
-                claimed,
-            )
+def claim_pending_jobs(limit: int = 5) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Fetch and claim up to `limit` pending jobs in a single transaction.
 
-    logger.info("✅ Returning %d pending job(s)", len(pending))
-    return pending[:limit]
+    The query read, the status flip and each job's 'processing'
+    event commit together, so two workers can never claim the same job and
+    the whole claim costs one read plus one commit. Returned job data is the
+    snapshot read before claiming, projected to PENDING_JOB_FIELDS. Only
+    jobs whose available_at has passed are read (see _pending_query).
+
+    All claim writes (2 per job) go out in the transaction's single commit
+    RPC, so `limit` is capped at MAX_BATCH_OPS // 2.
+
+    Claims always read the head of the queue: claimed jobs leave the
+    status == "pending" range, so no paging is needed.
+    """
+    limit = min(limit, MAX_BATCH_OPS // 2)
+    docs = _claim_in_transaction(db.transaction(), _pending_query(limit))
+
+    logger.info("✅ Claimed %d pending job(s)", len(docs))
+    return _to_jobs(docs)
+
+
+def get_rendering_jobs(limit: int = 20) -> List[Tuple[str, Optional[str]]]:
+    """
+    Fetch (job_id, render_id) pairs for jobs still rendering on Shotstack.
+
+    Only metadata.render_id is read back; render_id is None if a job is
+    missing it.
+    """
+    query = (
+        JOBS.select(RENDERING_JOB_FIELDS)
+        .where("status", "==", "rendering")
+        .limit(limit)
+    )
+
+    rendering = [(doc.id, _get_field(doc, "metadata.render_id")) for doc in query.stream()]
+
+    logger.info("✅ Returning %d rendering job(s)", len(rendering))
+    return rendering
+
+
+def watch_pending_jobs(on_pending: Callable[[Optional[datetime]], None]) -> Watch:
+    """
+    Subscribe to the head of the pending queue with a realtime listener.
+
+    `on_pending` is called (on the listener's thread) with the head job's
+    available_at whenever the head changes, or None once the queue is
+    empty, so the worker can wake up as soon as a job is claimable instead
+    of waiting for its next poll. Only the job with the earliest
+    available_at is watched: a new job sorts ahead of any job still backing
+    off, and listener reads stay at one doc per change. Call
+    `.unsubscribe()` on the result to stop.
+    """
+    def _on_snapshot(docs, changes, read_time) -> None:
+        on_pending(_get_field(docs[0], "available_at") if docs else None)
+
+    query = JOBS.where("status", "==", "pending").order_by("available_at").limit(1)
+    return query.on_snapshot(_on_snapshot)
+
+
+def watch_rendering_jobs(
+    on_update: Callable[[List[Tuple[str, Optional[str]]]], None], limit: int = 20
+) -> Watch:
+    """
+    Keep a live view of rendering jobs with a realtime listener.
+
+    `on_update` is called (on the listener's thread) with the current
+    (job_id, render_id) pairs, same shape as get_rendering_jobs, whenever
+    the set changes. After the initial snapshot only changed docs are read,
+    so render checks no longer need to re-query Firestore.
+    """
+    def _on_snapshot(docs, changes, read_time) -> None:
+        on_update([(doc.id, _get_field(doc, "metadata.render_id")) for doc in docs])
+
+    query = JOBS.where("status", "==", "rendering").limit(limit)
+    return query.on_snapshot(_on_snapshot)
 
 # ---------------------------------------------------------------------------
 # Job helpers used by the worker
 # ---------------------------------------------------------------------------
 
-def claim_job(job_id: str) -> None:
-    """Mark a job as claimed so other workers ignore it."""
-    logger.info("Firestore claim_job(%s)", job_id)
-    jobs_collection.document(job_id).set({"claimed": True}, merge=True)
+def create_job(data: Dict[str, Any]) -> str:
+    """
+    Insert a new job document and return its ID.
+
+    available_at defaults to created_at: pending jobs without it are never
+    claimed, so anything else that creates jobs must set it too.
+    """
+    job = dict(data)
+    job.setdefault("created_at", SERVER_TS)
+    job.setdefault("updated_at", SERVER_TS)
+    job.setdefault("available_at", job["created_at"])
+
+    _, job_ref = JOBS.add(job)
+    logger.info("Firestore create_job -> %s", job_ref.id)
+    return job_ref.id
+
+
+@firestore.transactional
+def _claim_if_pending(
+    transaction: firestore.Transaction, job_ref: firestore.DocumentReference
+) -> bool:
+    snapshot = job_ref.get(transaction=transaction)
+    data = snapshot.to_dict() or {}
+    if data.get("status") != "pending":
+        return False
+
+    _stage_claim(transaction, job_ref)
+    return True
+
+
+def claim_job(job_id: str) -> bool:
+    """
+    Claim a single pending job so other workers ignore it.
+
+    The read and the pending -> processing flip share one transaction, so
+    only one worker can win; returns False if the job is no longer pending.
+    """
+    logger.debug("Firestore claim_job(%s)", job_id)
+    claimed = _claim_if_pending(db.transaction(), JOBS.document(job_id))
+    if not claimed:
+        logger.info("Job %s is no longer pending; skipping", job_id)
+    return claimed
 
 
 def update_job(job_id: str, data: Dict[str, Any]) -> None:
-    """Merge updates into a job document."""
-    logger.info("Firestore update_job(%s, %s)", job_id, data)
-    jobs_collection.document(job_id).set(data, merge=True)
+    """Merge updates into a job document, bumping its server-side updated_at."""
+    logger.debug("Firestore update_job(%s, %s)", job_id, data)
+    data.setdefault("updated_at", SERVER_TS)
+    JOBS.document(job_id).set(data, merge=True)
 
 
 def add_event(job_id: str, event: Dict[str, Any]) -> None:
-    """Append an event to the job's 'events' subcollection."""
-    logger.info("Firestore add_event for job %s: %s", job_id, event)
-    events_ref = jobs_collection.document(job_id).collection("events")
-    events_ref.add(
+    """
+    Append an event to the job's events subcollection.
+
+    `event` is stamped in place with created_at (unless already set); the
+    job's events_count is bumped in the same batch.
+    """
+    logger.debug("Firestore add_event for job %s: %s", job_id, event)
+    event.setdefault("created_at", SERVER_TS)
+    job_ref = JOBS.document(job_id)
+    batch = db.batch()
+    batch.set(_events_ref(job_ref).document(), event)
+    batch.set(job_ref, {"events_count": EVENTS_COUNT_INCREMENT}, merge=True)
+    batch.commit()
+
+
+# (job_id, fields to update, event to append)
+JobTransition = Tuple[str, Dict[str, Any], Dict[str, Any]]
+
+
+def commit_job_transitions(transitions: Iterable[JobTransition]) -> None:
+    """
+    Apply job updates and their events in as few batch commits as possible.
+
+    Each transition stages a job update plus an 'events' subcollection write
+    (2 ops); batches are committed whenever they would exceed MAX_BATCH_OPS.
+    Updates are written with set(merge=True): pass nested maps such as
+    {"metadata": {"status": ...}} (not dotted keys), and sibling fields in
+    those maps are preserved. Updates and events are stamped in place
+    with server-side updated_at / created_at (unless already set), and
+    each update bumps the job's events_count.
+    """
+    batch = db.batch()
+    ops = 0
+    staged = 0
+
+    for job_id, data, event in transitions:
+        if ops + 2 > MAX_BATCH_OPS:
+            batch.commit()
+            batch = db.batch()
+            ops = 0
+
+        logger.debug("Firestore batch update(%s, %s) + event %s", job_id, data, event)
+        job_ref = JOBS.document(job_id)
+        data.setdefault("updated_at", SERVER_TS)
+        data["events_count"] = EVENTS_COUNT_INCREMENT
+        event.setdefault("created_at", SERVER_TS)
+        batch.set(job_ref, data, merge=True)
+        batch.set(_events_ref(job_ref).document(), event)
+        ops += 2
+        staged += 1
+
+    if ops:
+        batch.commit()
+        logger.info("Firestore committed %d job transition(s)", staged)
+
+
+def update_job_with_event(
+    job_id: str, data: Dict[str, Any], event: Dict[str, Any]
+) -> None:
+    """
+    Update a job and append an event to its 'events' subcollection
+    in a single atomic batch (one RPC instead of two).
+    """
+    commit_job_transitions([(job_id, data, event)])
+
+
+def completed_transition(job_id: str, output_url: str) -> JobTransition:
+    """Build the transition that marks a job completed with its output URL."""
+    return (
+        job_id,
+        {**_COMPLETED_UPDATE_TEMPLATE, "output_url": output_url},
         {
-            **event,
-            "created_at": firestore.SERVER_TIMESTAMP,
-        }
+            "type": "completed",
+            "message": f"Render completed: {output_url}",
+        },
+    )
+
+
+def mark_job_completed(job_id: str, output_url: str) -> None:
+    """Mark a job as completed and record the 'completed' event atomically."""
+    commit_job_transitions([completed_transition(job_id, output_url)])
+
+
+def release_jobs(job_ids: Iterable[str]) -> None:
+    """Put claimed jobs this worker never started back to 'pending'."""
+    commit_job_transitions(
+        (
+            job_id,
+            {"status": "pending", "available_at": SERVER_TS},
+            {"type": "released", "message": f"Worker {WORKER_ID} released job unstarted"},
+        )
+        for job_id in job_ids
     )
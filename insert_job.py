@@ -1,4 +1,3 @@
-import datetime
 from firebase_client import create_job
 
 
@@ -8,8 +7,6 @@ def queue_demo_job() -> None:
     The worker will render this using the Shotstack title template.
     """
 
-    now = datetime.datetime.now(datetime.timezone.utc)
-
     job_data = {
         "video_url": "https://example.com/placeholder.mp4",  # not used for title only
         "template": "demo-title",
@@ -26,8 +23,6 @@ def queue_demo_job() -> None:
         "metadata": {
             "source": "firebase-test",
         },
-        "created_at": now,
-        "updated_at": now,
     }
 
     job_id = create_job(job_data)
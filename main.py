@@ -1,24 +1,109 @@
 # main.py
 import logging
+import queue
+import random
+import signal
+import threading
 import time
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 from firebase_client import (
-    get_pending_jobs,
+    JobTransition,
+    claim_pending_jobs,
     get_rendering_jobs,
-    update_job,
-    add_event,
-    mark_job_claimed,
-    mark_job_completed,
+    watch_pending_jobs,
+    watch_rendering_jobs,
+    update_job_with_event,
+    commit_job_transitions,
+    completed_transition,
+    release_jobs,
 )
-from shotstack_client import submit_render, get_render_status
+from settings import get_settings
+from shotstack_client import submit_render, get_render_statuses
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=get_settings().log_level)
 logger = logging.getLogger(__name__)
 
-PENDING_POLL_SECONDS = 15        # how often to look for new jobs
-RENDER_STATUS_POLL_SECONDS = 60  # how often to check Shotstack
+PENDING_POLL_MIN_SECONDS = 1.0         # pending poll delay right after work
+PENDING_POLL_MAX_SECONDS = 300.0       # fallback pending poll cap (listener wakes us sooner)
+RENDER_STATUS_POLL_MIN_SECONDS = 10.0  # fallback check delay while renders are being checked
+RENDER_STATUS_POLL_SECONDS = 60.0      # fallback check delay cap (render_schedule wakes us sooner)
+RENDER_FIRST_CHECK_SECONDS = 20.0      # grace period before a new render's first check
+RENDER_RECHECK_MAX_SECONDS = 30.0      # cap on the per-render re-check delay
+
+DEFAULT_TEMPLATE = "demo-title"     # Shotstack template used when a job sets none
+VIDEO_URL_PLACEHOLDER = "VIDEO_URL"  # merge field replaced with the job's video_url
+
+CLAIM_CAPACITY = 10           # max claimed jobs held in the local buffer
+CLAIM_REFILL_THRESHOLD = 0.5  # only poll Firestore below this buffer fill ratio
+JOBS_PER_CYCLE = 5            # jobs submitted to Shotstack per loop iteration
+MAX_SUBMIT_ATTEMPTS = 5       # failed submits before a job is dead-lettered
+SUBMIT_RETRY_BASE_SECONDS = 30.0  # wait before retrying a failed submit, doubled per attempt
+SUBMIT_RETRY_MAX_SECONDS = 600.0  # cap on that wait
+
+# Jobs claimed in Firestore but not yet submitted to Shotstack
+pending_buffer: Deque[Tuple[str, Dict[str, Any]]] = deque()
+
+# Set by the Firestore listener whenever the head of the pending queue changes
+pending_signal = threading.Event()
+
+# When the head pending job becomes claimable (epoch seconds), as last
+# reported by the listener; None when there is nothing to wait for
+pending_head_due: Optional[float] = None
+
+# Rendering jobs pushed by the Firestore listener (None until its first
+# snapshot arrives or after it stops, in which case process_rendering_jobs
+# queries instead)
+rendering_view: Optional[List[Tuple[str, Optional[str]]]] = None
+
+# Per-job Shotstack check schedule: job_id -> (next_check_at, checks so far).
+# Jobs missing here (e.g. submitted by another worker) are checked right away.
+render_schedule: Dict[str, Tuple[float, int]] = {}
+
+# Runs one cycle's jobs concurrently (see process_pending_jobs)
+_job_pool = ThreadPoolExecutor(max_workers=JOBS_PER_CYCLE, thread_name_prefix="job")
+
+
+class PollingBackoff:
+    """
+    Exponential poll delay: grows by `factor` on every empty poll up to
+    `max_delay`, and drops back to `floor` as soon as a poll finds work.
+    Returned delays get up to `jitter` x delay of random slack so several
+    workers don't poll in lockstep.
+    """
+
+    def __init__(
+        self,
+        floor: float = 1.0,
+        max_delay: float = 30.0,
+        factor: float = 2.0,
+        jitter: float = 0.5,
+    ) -> None:
+        self.floor = floor
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.current_delay = floor
+
+    def next_delay(self, found: int) -> float:
+        """Record how much work the last poll found and return the next delay."""
+        if found:
+            self.current_delay = self.floor
+        else:
+            self.current_delay = min(self.current_delay * self.factor, self.max_delay)
+        return self._jittered()
+
+    def reset(self) -> float:
+        """Drop back to the floor delay (e.g. when new work was created)."""
+        self.current_delay = self.floor
+        return self._jittered()
+
+    def _jittered(self) -> float:
+        return self.current_delay + random.uniform(0, self.jitter * self.current_delay)
 
 
 def build_render_payload(job: Dict[str, Any]) -> Dict[str, Any]:
@@ -28,117 +113,213 @@ def build_render_payload(job: Dict[str, Any]) -> Dict[str, Any]:
     For now we use the demo-title template and replace VIDEO_URL.
     You can extend this later for other templates.
     """
-    template = job.get("template", "demo-title")
-    video_url = job.get("video_url")
-
-    payload: Dict[str, Any] = {
-        "templateId": template,
+    return {
+        "templateId": job.get("template", DEFAULT_TEMPLATE),
         "merge": [
             {
-                "find": "VIDEO_URL",
-                "replace": video_url,
+                "find": VIDEO_URL_PLACEHOLDER,
+                "replace": job.get("video_url"),
             }
         ],
     }
 
-    return payload
+
+def _recheck_delay(checks: int) -> float:
+    """Full-jitter backoff before re-checking a render that is still running."""
+    return random.uniform(0, min(RENDER_RECHECK_MAX_SECONDS, 5 * 2 ** checks))
 
 
 def process_pending_jobs() -> int:
     """
-    Fetch 'pending' jobs, claim them, send to Shotstack,
+    Claim 'pending' jobs, send them to Shotstack,
     and update Firestore to 'rendering'.
+
+    Claimed jobs go through `pending_buffer`; Firestore is only polled when
+    the buffer drops below CLAIM_REFILL_THRESHOLD of CLAIM_CAPACITY, so
+    bursts are worked off locally without extra reads.
     """
-    jobs: List[Tuple[str, Dict[str, Any]]] = get_pending_jobs(limit=5)
-    if not jobs:
+    if len(pending_buffer) < CLAIM_REFILL_THRESHOLD * CLAIM_CAPACITY:
+        claimed = claim_pending_jobs(limit=CLAIM_CAPACITY - len(pending_buffer))
+        pending_buffer.extend(claimed)
+    else:
+        logger.info("Buffer holds %d claimed job(s); skipping Firestore poll", len(pending_buffer))
+
+    if not pending_buffer:
         logger.info("No pending jobs found.")
         return 0
 
-    logger.info("Found %d pending job(s)", len(jobs))
+    jobs: List[Tuple[str, Dict[str, Any]]] = [
+        pending_buffer.popleft()
+        for _ in range(min(JOBS_PER_CYCLE, len(pending_buffer)))
+    ]
 
-    for job_id, job in jobs:
-        logger.info("Processing job %s: %s", job_id, job)
+    logger.info("Processing %d pending job(s)", len(jobs))
 
-        # 1. Mark job as claimed + processing
-        mark_job_claimed(job_id)
-        update_job(job_id, {"status": "processing"})
-        add_event(
-            job_id,
-            {"type": "processing", "message": "Worker picked up job"},
-        )
+    # Each job is pure I/O (Shotstack + Firestore), so submit them in parallel
+    list(_job_pool.map(lambda item: process_job(*item), jobs))
 
-        # 2. Build payload and submit render to Shotstack
-        payload = build_render_payload(job)
-        render_id = submit_render(payload)
+    return len(jobs)
 
-        logger.info("✅ Job %s submitted to Shotstack, render_id=%s", job_id, render_id)
 
-        # 3. Save render_id and mark as rendering
-        update_job(
-            job_id,
-            {
+def process_job(job_id: str, job: Dict[str, Any]) -> None:
+    """Submit one claimed job to Shotstack and mark it as rendering."""
+    logger.debug("Processing job %s (template=%s)", job_id, job.get("template"))
+
+    # 1. Job is already claimed + processing, with its 'processing'
+    #    event written in the same commit (see claim_pending_jobs)
+
+    # 2. Build payload and submit render to Shotstack
+    payload = build_render_payload(job)
+    try:
+        render_id = submit_render(payload)
+    except Exception as exc:
+        logger.exception("❌ Job %s failed to submit to Shotstack", job_id)
+        fail_job_submission(job_id, job, exc)
+        return
+
+    logger.info("✅ Job %s submitted to Shotstack, render_id=%s", job_id, render_id)
+
+    # Renders take a while; don't ask Shotstack about this one straight away
+    render_schedule[job_id] = (time.time() + RENDER_FIRST_CHECK_SECONDS, 0)
+
+    # 3. Save render_id, mark as rendering and log the submission
+    update_job_with_event(
+        job_id,
+        {
+            "status": "rendering",
+            "metadata": {
+                "render_id": render_id,
                 "status": "rendering",
-                "metadata.render_id": render_id,
-                "metadata.status": "rendering",
             },
-        )
+        },
+        {
+            "type": "render_submitted",
+            "message": f"Render submitted to Shotstack with id {render_id}",
+        },
+    )
+
 
-        add_event(
+def fail_job_submission(job_id: str, job: Dict[str, Any], exc: Exception) -> None:
+    """
+    Put a job whose submit failed back to 'pending' with its error recorded,
+    or park it as 'dead' once it has failed MAX_SUBMIT_ATTEMPTS times so a
+    poisoned job can't keep taking a slot from healthy ones.
+
+    Re-queued jobs get an available_at pushed out with exponential backoff
+    (claims skip them until then), so the attempts span several minutes and
+    a short Shotstack outage can't use them all up.
+    """
+    error = str(exc)
+    metadata = dict(job.get("metadata") or ())
+    metadata["error"] = error
+    metadata["retry_count"] = metadata.get("retry_count", 0) + 1
+
+    if metadata["retry_count"] >= MAX_SUBMIT_ATTEMPTS:
+        logger.error("💀 Job %s failed %d times; marking as dead", job_id, metadata["retry_count"])
+        metadata["dead_reason"] = error
+        update_job_with_event(
             job_id,
+            {"status": "dead", "metadata": metadata},
             {
-                "type": "render_submitted",
-                "message": f"Render submitted to Shotstack with id {render_id}",
+                "type": "dead",
+                "message": f"Gave up after {metadata['retry_count']} failed submits: {error}",
             },
         )
+        return
 
-    return len(jobs)
+    delay = min(
+        SUBMIT_RETRY_MAX_SECONDS,
+        SUBMIT_RETRY_BASE_SECONDS * 2 ** (metadata["retry_count"] - 1),
+    )
+    available_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+
+    update_job_with_event(
+        job_id,
+        {"status": "pending", "available_at": available_at, "metadata": metadata},
+        {
+            "type": "retry",
+            "message": f"Shotstack submit failed (attempt {metadata['retry_count']}): {error}",
+        },
+    )
 
 
 def process_rendering_jobs() -> int:
     """
     Look for jobs already submitted to Shotstack (status='rendering')
     and update them when Shotstack is DONE or FAILED.
+
+    Uses the listener-maintained `rendering_view` when available and only
+    falls back to querying Firestore before the listener has caught up.
+    Jobs whose `render_schedule` entry isn't due yet are skipped.
+
+    Returns the number of jobs checked with Shotstack.
     """
-    jobs: List[Tuple[str, Dict[str, Any]]] = get_rendering_jobs(limit=20)
+    jobs = rendering_view if rendering_view is not None else get_rendering_jobs(limit=20)
+    now = time.time()
+
+    # Forget overdue schedules for jobs that are no longer rendering (fresh
+    # ones are kept: the listener may not have seen the job yet)
+    for stale_id in render_schedule.keys() - {job_id for job_id, _ in jobs}:
+        if render_schedule[stale_id][0] <= now:
+            del render_schedule[stale_id]
+
     if not jobs:
         logger.info("No rendering jobs to check.")
         return 0
 
-    logger.info("Checking %d rendering job(s) with Shotstack", len(jobs))
-
-    updated = 0
-
-    for job_id, job in jobs:
-        metadata = job.get("metadata", {})
-        render_id = metadata.get("render_id")
+    to_check: List[Tuple[str, str]] = []
 
+    for job_id, render_id in jobs:
         if not render_id:
             logger.warning(
                 "Job %s has status 'rendering' but no metadata.render_id; skipping",
                 job_id,
             )
+            render_schedule.pop(job_id, None)
+            continue
+
+        if render_schedule.get(job_id, (0.0, 0))[0] > now:
+            continue
+
+        to_check.append((job_id, render_id))
+
+    if not to_check:
+        logger.info("No rendering jobs due for a check.")
+        return 0
+
+    logger.info("Checking %d rendering job(s) with Shotstack", len(to_check))
+
+    # Fan the Shotstack status checks out concurrently
+    statuses = get_render_statuses([render_id for _, render_id in to_check])
+
+    # Finished jobs are written back together in one batch commit
+    transitions: List[JobTransition] = []
+
+    for (job_id, _), status_info in zip(to_check, statuses):
+        # Status check failed (already logged): try this job again later
+        if status_info is None:
+            checks = render_schedule.get(job_id, (0.0, 0))[1]
+            render_schedule[job_id] = (now + _recheck_delay(checks), checks + 1)
             continue
 
-        status_info = get_render_status(render_id)
         render_status = (status_info.get("status") or "").lower()
         output_url = status_info.get("url")
 
-        # Still in progress
+        # Still in progress: check again later, backing off per job
         if render_status in ("queued", "fetching", "rendering"):
-            logger.info("Job %s still rendering (%s)", job_id, render_status)
+            logger.debug("Job %s still rendering (%s)", job_id, render_status)
+            checks = render_schedule.get(job_id, (0.0, 0))[1]
+            render_schedule[job_id] = (now + _recheck_delay(checks), checks + 1)
             continue
 
+        render_schedule.pop(job_id, None)
+
         # Finished successfully
         if render_status == "done" and output_url:
             logger.info(
                 "Job %s render DONE, saving output_url=%s", job_id, output_url
             )
-            mark_job_completed(
-                job_id,
-                output_url,
-                finished_at=datetime.now(timezone.utc),
-            )
-            updated += 1
+            transitions.append(completed_transition(job_id, output_url))
             continue
 
         # Failed or unknown state
@@ -147,44 +328,138 @@ def process_rendering_jobs() -> int:
             job_id,
             render_status,
         )
-        update_job(
-            job_id,
-            {
-                "status": "failed",
-                "metadata.status": render_status,
-            },
-        )
-        add_event(
-            job_id,
-            {
-                "type": "failed",
-                "message": f"Shotstack render failed or unknown status: {render_status}",
-            },
+        transitions.append(
+            (
+                job_id,
+                {
+                    "status": "failed",
+                    "metadata": {"status": render_status},
+                },
+                {
+                    "type": "failed",
+                    "message": f"Shotstack render failed or unknown status: {render_status}",
+                },
+            )
         )
-        updated += 1
 
-    return updated
+    commit_job_transitions(transitions)
+    return len(to_check)
 
 
-def main() -> None:
-    logger.info("🚀 Starting Cre8 Firebase + Shotstack worker (auto-save mode)...")
+def _next_scheduled_check() -> float:
+    """Earliest next_check_at in `render_schedule` (inf when it is empty)."""
+    return min((due for due, _ in list(render_schedule.values())), default=float("inf"))
+
+
+def _on_pending_head(available_at: Optional[datetime]) -> None:
+    """Listener callback: note when the head pending job is claimable and wake up."""
+    global pending_head_due
+    pending_head_due = available_at.timestamp() if available_at is not None else None
+    pending_signal.set()
+
 
-    last_render_check = 0.0
+def _set_rendering_view(jobs: Optional[List[Tuple[str, Optional[str]]]]) -> None:
+    """Listener callback: swap in the latest rendering jobs."""
+    global rendering_view
+    rendering_view = jobs
 
-    while True:
-        # 1) Handle new pending jobs
-        processed = process_pending_jobs()
 
-        # 2) Periodically check rendering jobs
-        now = time.time()
-        if now - last_render_check >= RENDER_STATUS_POLL_SECONDS:
-            process_rendering_jobs()
-            last_render_check = now
+def _start_log_listener() -> QueueListener:
+    """
+    Route log records through a queue so handler I/O runs on a background
+    thread instead of the job / status-check threads.
+    """
+    root = logging.getLogger()
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+
+def _exit_on_sigterm(signum: int, frame: Any) -> None:
+    """Turn SIGTERM (e.g. `docker stop`) into SystemExit so cleanup runs."""
+    raise SystemExit(0)
+
+
+def main() -> None:
+    global pending_head_due
+
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    log_listener = _start_log_listener()
+    logger.info("🚀 Starting Cre8 Firebase + Shotstack worker (auto-save mode)...")
 
-        # 3) Sleep if nothing to do
-        if processed == 0:
-            logger.info("No work right now. Sleeping %s seconds...", PENDING_POLL_SECONDS)
-            time.sleep(PENDING_POLL_SECONDS)
+    pending_backoff = PollingBackoff(
+        floor=PENDING_POLL_MIN_SECONDS, max_delay=PENDING_POLL_MAX_SECONDS
+    )
+    render_backoff = PollingBackoff(
+        floor=RENDER_STATUS_POLL_MIN_SECONDS, max_delay=RENDER_STATUS_POLL_SECONDS
+    )
+    next_pending_poll = 0.0
+    next_render_check = 0.0
+
+    # Wake up as soon as a pending job is claimable. The listener doubles as
+    # a cache of "is the queue empty?", so idle loops skip the claim query
+    # and only fall back to polling on the (long) backoff schedule.
+    watch = watch_pending_jobs(_on_pending_head)
+    rendering_watch = watch_rendering_jobs(_set_rendering_view)
+
+    try:
+        while True:
+            now = time.time()
+            processed = 0
+            pending_signal.clear()
+            head_due = pending_head_due
+
+            # 1) Handle pending jobs when the queue head is claimable,
+            #    jobs are buffered or the fallback poll is due
+            head_ready = head_due is not None and now >= head_due
+            if head_ready or pending_buffer or now >= next_pending_poll:
+                processed = process_pending_jobs()
+                next_pending_poll = now + pending_backoff.next_delay(processed)
+
+                # Acted on this head; the listener reports the next one
+                if head_ready and pending_head_due == head_due:
+                    pending_head_due = None
+
+                # Fresh renders were submitted: check on them when the first is due
+                if processed:
+                    next_render_check = min(next_render_check, _next_scheduled_check())
+
+            # 2) Check rendering jobs when the earliest per-job check is due,
+            #    with a backoff fallback for jobs this worker didn't submit
+            if now >= next_render_check:
+                # A listener closed on a non-retryable error never updates
+                # again: drop its view so the check queries Firestore instead
+                if rendering_view is not None and not rendering_watch.is_active:
+                    logger.warning("Rendering listener stopped; falling back to Firestore queries")
+                    _set_rendering_view(None)
+
+                checked = process_rendering_jobs()
+                next_render_check = min(
+                    now + render_backoff.next_delay(checked), _next_scheduled_check()
+                )
+
+            # 3) Wait for the listener or the next scheduled check
+            if processed == 0:
+                wake_at = min(next_pending_poll, next_render_check)
+                if pending_head_due is not None:
+                    wake_at = min(wake_at, pending_head_due)
+                timeout = max(wake_at - time.time(), 0.0)
+                logger.info("No work right now. Waiting up to %.1f seconds...", timeout)
+                pending_signal.wait(timeout=timeout)
+    finally:
+        watch.unsubscribe()
+        rendering_watch.unsubscribe()
+
+        # Jobs still buffered are 'processing' in Firestore but were never
+        # submitted; hand them back so another worker picks them up
+        if pending_buffer:
+            logger.info("Releasing %d buffered job(s) back to pending", len(pending_buffer))
+            release_jobs([job_id for job_id, _ in pending_buffer])
+            pending_buffer.clear()
+
+        log_listener.stop()
 
 
 if __name__ == "__main__":
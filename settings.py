@@ -0,0 +1,41 @@
+# settings.py
+import functools
+import os
+import socket
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Worker configuration, read once from the environment (and .env)."""
+
+    shotstack_api_key: Optional[str]
+    shotstack_env: str  # "stage" or "production"
+    firebase_key_json: Optional[str]  # full JSON of the service account key
+    jobs_collection: str
+    worker_id: str
+    firestore_api_endpoint: str
+    log_level: str
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Load settings once per process.
+
+    A local .env is loaded first if present; variables already set in the
+    environment (e.g. in Docker) take precedence over it.
+    """
+    load_dotenv()
+    return Settings(
+        shotstack_api_key=os.getenv("SHOTSTACK_API_KEY"),
+        shotstack_env=os.getenv("SHOTSTACK_ENV", "stage"),
+        firebase_key_json=os.getenv("FIREBASE_KEY_JSON"),
+        jobs_collection=os.getenv("FIREBASE_JOBS_COLLECTION", "jobs"),
+        worker_id=os.getenv("WORKER_ID", socket.gethostname()),
+        firestore_api_endpoint=os.getenv("FIRESTORE_API_ENDPOINT", "firestore.googleapis.com"),
+        log_level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    )
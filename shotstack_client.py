@@ -1,16 +1,112 @@
 # shotstack_client.py
 import logging
-import os
-from typing import Any, Dict
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+
+from settings import get_settings
+
+settings = get_settings()
 
 logger = logging.getLogger(__name__)
 
-SHOTSTACK_API_KEY = os.getenv("SHOTSTACK_API_KEY")
-SHOTSTACK_ENV = os.getenv("SHOTSTACK_ENV", "stage")  # "stage" or "production"
+SHOTSTACK_API_KEY = settings.shotstack_api_key
+SHOTSTACK_ENV = settings.shotstack_env  # "stage" or "production"
 
 BASE_URL = f"https://api.shotstack.io/{SHOTSTACK_ENV}"
+RENDER_URL = BASE_URL + "/render"
+RENDER_STATUS_URL_PREFIX = RENDER_URL + "/"
+
+# Max number of status checks in flight at once
+STATUS_POLL_CONCURRENCY = 10
+
+# Long-lived pool for status checks, reused across polls
+_status_pool = ThreadPoolExecutor(
+    max_workers=STATUS_POLL_CONCURRENCY,
+    thread_name_prefix="shotstack-status",
+)
+
+# One pooled session for all Shotstack calls: keep-alive connections are
+# reused across submits and status polls instead of a TLS handshake per
+# call. The pool covers both thread pools; retries are handled by
+# _request_with_retry, so the adapter itself never retries.
+SESSION = requests.Session()
+SESSION.headers.update(
+    {
+        "x-api-key": SHOTSTACK_API_KEY,
+        "content-type": "application/json",
+        "accept-encoding": "gzip",
+    }
+)
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=0))
+
+# Retry policy for transient Shotstack failures (full-jitter backoff)
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+
+# Rate limiting and transient server errors: safe to retry a status GET
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504, 529}
+# A render POST is only retried when Shotstack refused it outright, so a
+# retry can never create a duplicate render
+RETRYABLE_SUBMIT_STATUSES = {429, 503}
+
+
+def _retry_delay(attempt: int, resp: Optional[requests.Response]) -> float:
+    """Full-jitter exponential backoff, honouring a numeric Retry-After."""
+    retry_after = resp.headers.get("Retry-After", "") if resp is not None else ""
+    if retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_CAP_SECONDS)
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _request_with_retry(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """
+    Send a Shotstack request, retrying transient failures in place.
+
+    GETs retry on timeouts, connection errors and RETRYABLE_STATUSES; POSTs
+    only on connect timeouts and RETRYABLE_SUBMIT_STATUSES. Anything else
+    (e.g. a 4xx for a bad payload), or the last failed attempt, is raised.
+    """
+    if method == "GET":
+        retry_errors: Tuple[Type[Exception], ...] = (
+            requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError,
+        )
+        retry_statuses = RETRYABLE_STATUSES
+    else:
+        retry_errors = (requests.exceptions.ConnectTimeout,)
+        retry_statuses = RETRYABLE_SUBMIT_STATUSES
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            resp = SESSION.request(method, url, **kwargs)
+        except retry_errors as e:
+            if attempt >= MAX_ATTEMPTS:
+                raise
+            logger.warning("Shotstack %s %s failed (%s); retry %d", method, url, e, attempt)
+            time.sleep(_retry_delay(attempt, None))
+            continue
+
+        if resp.status_code in retry_statuses and attempt < MAX_ATTEMPTS:
+            logger.warning(
+                "Shotstack %s %s returned %s; retry %d", method, url, resp.status_code, attempt
+            )
+            delay = _retry_delay(attempt, resp)
+            # Hand the pooled connection back before sleeping
+            resp.close()
+            time.sleep(delay)
+            continue
+
+        resp.raise_for_status()
+        return resp
 
 
 def submit_render(payload: Dict[str, Any]) -> str:
@@ -20,19 +116,16 @@ def submit_render(payload: Dict[str, Any]) -> str:
     if not SHOTSTACK_API_KEY:
         raise RuntimeError("SHOTSTACK_API_KEY is not set")
 
-    url = f"{BASE_URL}/render"
-    headers = {
-        "x-api-key": SHOTSTACK_API_KEY,
-        "content-type": "application/json",
-    }
+    url = RENDER_URL
 
-    logger.info("Submitting render to Shotstack: %s", url)
-    resp = requests.post(url, json=payload, headers=headers, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-    logger.info("Shotstack response [%s]: %s", resp.status_code, data)
+    logger.debug("Submitting render to Shotstack: %s", url)
+    resp = _request_with_retry("POST", url, data=orjson.dumps(payload), timeout=30)
+    data = orjson.loads(resp.content)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Shotstack response [%s]: %s", resp.status_code, resp.content[:1024])
 
     render_id = data["response"]["id"]
+    logger.info("Shotstack accepted render id=%s (HTTP %s)", render_id, resp.status_code)
     return render_id
 
 
@@ -50,25 +143,41 @@ def get_render_status(render_id: str) -> Dict[str, Any]:
     if not SHOTSTACK_API_KEY:
         raise RuntimeError("SHOTSTACK_API_KEY is not set")
 
-    url = f"{BASE_URL}/render/{render_id}"
-    headers = {
-        "x-api-key": SHOTSTACK_API_KEY,
-        "content-type": "application/json",
-    }
+    url = RENDER_STATUS_URL_PREFIX + render_id
 
-    logger.info("Checking Shotstack status for render_id=%s", render_id)
-    resp = requests.get(url, headers=headers, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+    logger.debug("Checking Shotstack status for render_id=%s", render_id)
+    resp = _request_with_retry("GET", url, timeout=30)
+    data = orjson.loads(resp.content)
 
     response = data.get("response", {})
     status = response.get("status")
     output_url = response.get("url")  # final mp4 URL
 
-    logger.info("Shotstack status for %s: %s, url=%s", render_id, status, output_url)
+    logger.debug("Shotstack status for %s: %s, url=%s", render_id, status, output_url)
 
     return {
         "status": status,
         "url": output_url,
         "raw": response,
     }
+
+
+def _get_render_status_or_none(render_id: str) -> Optional[Dict[str, Any]]:
+    """get_render_status(), logging and swallowing errors (returns None)."""
+    try:
+        return get_render_status(render_id)
+    except Exception:
+        logger.exception("❌ Shotstack status check failed for render_id=%s", render_id)
+        return None
+
+
+def get_render_statuses(render_ids: Sequence[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Check many renders concurrently.
+
+    Returns one get_render_status() result per render_id, in the same order,
+    so N status checks take roughly one round trip instead of N. A check
+    that fails (e.g. a 404 or retries exhausted) yields None instead of
+    discarding the whole batch.
+    """
+    return list(_status_pool.map(_get_render_status_or_none, render_ids))
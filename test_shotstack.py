@@ -1,11 +1,13 @@
 import os
 import requests
-from dotenv import load_dotenv
 
-load_dotenv()
+from settings import get_settings
 
-API_KEY = os.getenv("SHOTSTACK_API_KEY")
-BASE_URL = os.getenv("SHOTSTACK_BASE_URL", "https://api.shotstack.io/sandbox/v1")
+settings = get_settings()
+
+API_KEY = settings.shotstack_api_key
+# Same environment as the worker unless explicitly overridden
+BASE_URL = os.getenv("SHOTSTACK_BASE_URL", f"https://api.shotstack.io/{settings.shotstack_env}")
 
 RENDER_URL = f"{BASE_URL}/render"
 